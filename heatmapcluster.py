@@ -25,22 +25,440 @@
 
 from __future__ import division as _division
 
+import hashlib as _hashlib
+import threading as _threading
 import numpy as _np
-from scipy import __version__ as _scipy__version__
-from scipy.spatial import distance as _distance
+from scipy.spatial.distance import squareform as _squareform
 import scipy.cluster.hierarchy as _hierarchy
-import matplotlib.pyplot as _plt
-from mpl_toolkits import axes_grid1 as _axes_grid1
+
+try:
+    import cupy as _cupy
+except ImportError:
+    _cupy = None
+
+try:
+    import fastcluster as _fastcluster
+except ImportError:
+    _fastcluster = None
 
 
 __version__ = "0.1.3.dev1"
 
-_scipy_version = tuple(int(v) for v in _scipy__version__.split('.')[:2])
+# Cache of the default linkages computed by heatmapcluster().  The keys are
+# created by _array_key(); see _default_linkage().
+_linkage_cache = {}
+_LINKAGE_CACHE_SIZE = 16
+# heatmapcluster() and compute() may be called from several threads, so all
+# access to _linkage_cache holds this lock.
+_linkage_cache_lock = _threading.Lock()
+
+# With backend='auto', the distances are computed on the GPU if cupy is
+# installed and x.size exceeds this value.
+cuda_threshold = 10**7
+
+# If fastcluster is installed, the default linkage of m observations is
+# computed with fastcluster.linkage_vector (which does not store the
+# distances) when the condensed distance vector would have more than this
+# many elements, i.e. when m*(m - 1)/2 exceeds it.  For smaller inputs the
+# other implementations are faster.
+fastcluster_threshold = 10**8
+
+# If numba is installed, the default distances between m observations are
+# computed with a numba kernel when m*(m - 1)/2 exceeds this value (and
+# the observations have at most _NUMBA_MAX_FEATURES features).  For smaller
+# inputs, importing numba and loading the compiled kernel costs more than
+# it saves, and for observations with many features, the BLAS based
+# _pdist_gemm() is faster.
+numba_threshold = 10**7
+_NUMBA_MAX_FEATURES = 128
+
+# The numba kernel, created by _get_numba_kernel().  None means that it has
+# not been created yet, and False that numba is not installed.
+_numba_kernel = None
+_numba_kernel_lock = _threading.Lock()
+
+
+def clear_cache():
+    """
+    Clear the cache of linkages computed by heatmapcluster().
+    """
+    with _linkage_cache_lock:
+        _linkage_cache.clear()
+
+
+def _array_key(x):
+    """
+    Return a hashable key that identifies the contents of the array x.
+    """
+    x = _np.ascontiguousarray(x)
+    digest = _hashlib.sha1(x.view(_np.uint8)).hexdigest()
+    return (x.shape, x.dtype.str, digest)
+
+
+def _make_pdist_euclid_nb(numba):
+    """
+    Create the numba kernel that computes the Euclidean distances between
+    the rows of x, in the condensed form returned by
+    scipy.spatial.distance.pdist.
+    """
+    @numba.njit(parallel=True, fastmath=True, cache=True)
+    def _pdist_euclid_nb(x):
+        m, n = x.shape
+        out = _np.empty(m*(m - 1)//2)
+        for i in numba.prange(m):
+            # out[base + j] holds the distance between rows i and j.
+            base = i*m - i*(i + 1)//2 - i - 1
+            for j in range(i + 1, m):
+                s = 0.0
+                for k in range(n):
+                    d = x[i, k] - x[j, k]
+                    s += d*d
+                out[base + j] = _np.sqrt(s)
+        return out
+
+    return _pdist_euclid_nb
+
+
+def _get_numba_kernel():
+    """
+    Return the numba kernel created by _make_pdist_euclid_nb(), or None if
+    numba is not installed.
+
+    numba is imported when this function is first called, because
+    importing it is slow.
+    """
+    global _numba_kernel
+    with _numba_kernel_lock:
+        if _numba_kernel is None:
+            try:
+                import numba
+            except ImportError:
+                _numba_kernel = False
+            else:
+                _numba_kernel = _make_pdist_euclid_nb(numba)
+    return _numba_kernel or None
+
+
+def _use_numba(nobs, nfeatures):
+    """
+    Return True if the default distances between nobs observations with
+    nfeatures features should be computed with the numba kernel.
+    """
+    return (nobs*(nobs - 1)//2 > numba_threshold and
+            nfeatures <= _NUMBA_MAX_FEATURES and
+            _get_numba_kernel() is not None)
+
+
+def _gram_to_sq_dist(g):
+    """
+    Overwrite the Gram matrix g of a set of vectors with the squared
+    Euclidean distances between the vectors, and return g.
+
+    The squared distances are computed with the expansion
+    |a - b|**2 = |a|**2 + |b|**2 - 2*a.b.  The squared norms are taken
+    from the diagonal of g, so that they are rounded consistently with
+    the dot products, and identical vectors get a distance of exactly 0.
+    The work is done in place, so no other array of the size of g is
+    allocated.
+    """
+    sq_norms = g.diagonal().copy()
+    g *= -2
+    g += sq_norms[:, None]
+    g += sq_norms
+    return g
+
+
+def _sq_dist_to_pdist(d2):
+    """
+    Convert the square matrix d2 of squared distances to distances in
+    condensed form.  Only the upper triangle of d2 is used.
+    """
+    d = _squareform(d2, checks=False)
+    _np.maximum(d, 0, out=d)
+    _np.sqrt(d, out=d)
+    return d
+
+
+def _pdist_gemm(x):
+    """
+    Euclidean distances between the rows of x, in condensed form.
+
+    The bulk of the work is the single matrix product x.dot(x.T).  It is
+    always done in float64, because the expansion used by
+    _gram_to_sq_dist() loses too much precision for close points in
+    float32.
+    """
+    # Subtracting the column means does not change the distances, and it
+    # reduces the round-off error of the expansion.  This also converts x
+    # to float64, with a single copy.
+    x = _np.asarray(x)
+    x = _np.subtract(x, x.mean(axis=0, dtype=_np.float64), dtype=_np.float64)
+    return _sq_dist_to_pdist(_gram_to_sq_dist(x.dot(x.T)))
+
+
+def _pdist_gemm_pair(x):
+    """
+    Euclidean distances between the rows of x and between the columns
+    of x, in condensed form.
+
+    Both are computed from a single float64 copy of x, so x is converted
+    only once.  (The expansion used by _gram_to_sq_dist() loses too much
+    precision for close points when it is done in float32.)  The column
+    means are subtracted from the copy.  That does not change the row
+    distances.  The columns of the copy have zero mean, so if a and b are
+    columns of x with means ma and mb, and a' and b' are the corresponding
+    centered columns, |a - b|**2 = |a' - b'|**2 + m*(ma - mb)**2, where m
+    is the number of rows.
+    """
+    x = _np.array(x, dtype=_np.float64)
+    m = x.shape[0]
+    means = x.mean(axis=0)
+    x -= means
+
+    d_row = _sq_dist_to_pdist(_gram_to_sq_dist(x.dot(x.T)))
+
+    d2 = _gram_to_sq_dist(x.T.dot(x))
+    # Only the upper triangle is used by _sq_dist_to_pdist().
+    for i in range(len(means) - 1):
+        d2[i, i+1:] += m*(means[i] - means[i+1:])**2
+    d_col = _sq_dist_to_pdist(d2)
+    return d_row, d_col
+
+
+def _pdist_cuda(x):
+    """
+    Euclidean distances between the rows of x, in condensed form,
+    computed on the GPU with cupy.
+
+    This uses the same expansion as _pdist_gemm(), also in float64.
+    """
+    xd = _cupy.asarray(x, dtype=_cupy.float64)
+    xd = xd - xd.mean(axis=0)
+    d2 = xd.dot(xd.T)
+    sq_norms = d2.diagonal().copy()
+    d2 *= -2
+    d2 += sq_norms[:, None]
+    d2 += sq_norms
+    # Copy the upper triangle to the condensed array one row at a time,
+    # to avoid creating index arrays with m*(m - 1)/2 elements.
+    m = d2.shape[0]
+    d = _cupy.empty(m*(m - 1)//2)
+    start = 0
+    for i in range(m - 1):
+        d[start:start + m - 1 - i] = d2[i, i+1:]
+        start += m - 1 - i
+    _cupy.maximum(d, 0, out=d)
+    _cupy.sqrt(d, out=d)
+    return _cupy.asnumpy(d)
+
+
+def _resolve_backend(backend, x):
+    """
+    Convert the `backend` argument of heatmapcluster() to 'cpu' or 'cuda'.
+    """
+    if backend not in ['auto', 'cpu', 'cuda']:
+        raise ValueError("backend must be 'auto', 'cpu' or 'cuda'.")
+    if backend == 'auto':
+        if _cupy is not None and x.size > cuda_threshold:
+            backend = 'cuda'
+        else:
+            backend = 'cpu'
+    elif backend == 'cuda' and _cupy is None:
+        raise ValueError("backend='cuda' requires cupy to be installed.")
+    return backend
+
+
+def _pdist(x, backend='cpu'):
+    """
+    Euclidean distances between the rows of x, in condensed form.
+
+    If backend is 'cuda', the distances are computed with _pdist_cuda().
+    Otherwise, the numba kernel is used if _use_numba() is True, and if it
+    is not, the distances are computed with _pdist_gemm().
+
+    For the numba kernel, the data is converted to float32, so the kernel
+    is only compiled for one dtype, and it moves half as much data as with
+    float64.  The column means are subtracted first (in float32 for
+    float32 input, otherwise in float64), so a large common offset in the
+    data does not swamp the differences between the rows when they are
+    rounded to float32.  The other implementations work in float64.
+    """
+    if backend == 'cuda':
+        return _pdist_cuda(x)
+    if _use_numba(*x.shape):
+        # Subtracting the column means does not change the distances.  The
+        # result is C-contiguous, so when x is the transpose view used for
+        # the column distances, the transpose is materialized here.  Input
+        # that is not float32 (e.g. float16, integers or booleans) is
+        # centered in float64.
+        if x.dtype != _np.float32:
+            x = _np.asarray(x, dtype=_np.float64)
+        x = _np.subtract(x, x.mean(axis=0), order='C')
+        x = _np.ascontiguousarray(x, dtype=_np.float32)
+        return _get_numba_kernel()(x)
+    return _pdist_gemm(x)
+
+
+def _use_fastcluster(nobs):
+    """
+    Return True if the default linkage of nobs observations should be
+    computed with fastcluster.linkage_vector.
+    """
+    return (_fastcluster is not None and
+            nobs*(nobs - 1)//2 > fastcluster_threshold)
+
+
+def _default_linkage(x, axis, key, backend):
+    """
+    Compute the default linkage of the rows (axis=0) or columns (axis=1)
+    of x.  This is the single linkage of the Euclidean distances.  If
+    backend is 'cpu' and _use_fastcluster() is True, it is computed with
+    fastcluster.linkage_vector; otherwise the distances are computed by
+    `_pdist(..., backend)` and passed to scipy's linkage function.
+
+    `key` must be the value returned by `_array_key(x)`.  The result is
+    cached, so repeated calls with the same data do not recompute the
+    distances.  The returned array is always a new array that the caller
+    may modify.
+    """
+    cache_key = (axis,) + key
+    lnk = _cached_linkage(cache_key)
+    if lnk is None:
+        obs = x if axis == 0 else x.T
+        if backend == 'cpu' and _use_fastcluster(obs.shape[0]):
+            # The single linkage is computed from the observations, without
+            # forming the full condensed distance matrix.
+            lnk = _fastcluster.linkage_vector(obs, method='single')
+        else:
+            lnk = _hierarchy.linkage(_pdist(obs, backend))
+        _cache_linkage(cache_key, lnk)
+    return lnk
+
+
+def _cached_linkage(cache_key):
+    """
+    Return a copy of the cached linkage for cache_key, or None if it is
+    not in the cache.
+    """
+    with _linkage_cache_lock:
+        lnk = _linkage_cache.get(cache_key)
+    if lnk is not None:
+        lnk = lnk.copy()
+    return lnk
+
+
+def _cache_linkage(cache_key, lnk):
+    """
+    Add a copy of the linkage lnk to the cache.
+
+    The cache holds its own copy, so the caller may modify lnk.
+    """
+    lnk = lnk.copy()
+    with _linkage_cache_lock:
+        if len(_linkage_cache) >= _LINKAGE_CACHE_SIZE:
+            _linkage_cache.pop(next(iter(_linkage_cache)))
+        _linkage_cache[cache_key] = lnk
+
+
+def _default_linkages(x, key, backend):
+    """
+    Compute the default linkages of the rows and of the columns of x.
+
+    When the distances would be computed by _pdist_gemm(), both sets of
+    distances are computed together by _pdist_gemm_pair().  Otherwise the
+    linkages are computed one after the other by _default_linkage().
+    """
+    row_key = (0,) + key
+    col_key = (1,) + key
+    with _linkage_cache_lock:
+        cached = row_key in _linkage_cache or col_key in _linkage_cache
+    m, n = x.shape
+    if (backend == 'cpu' and not _use_fastcluster(m) and
+            not _use_fastcluster(n) and not _use_numba(m, n) and
+            not _use_numba(n, m) and not cached):
+        d_row, d_col = _pdist_gemm_pair(x)
+        lnk0 = _hierarchy.linkage(d_row)
+        lnk1 = _hierarchy.linkage(d_col)
+        _cache_linkage(row_key, lnk0)
+        _cache_linkage(col_key, lnk1)
+        return lnk0, lnk1
+
+    return (_default_linkage(x, 0, key, backend),
+            _default_linkage(x, 1, key, backend))
+
+
+def _optimal_leaf_order(lnk, x, axis, key, backend):
+    """
+    Reorder the default linkage lnk of the rows (axis=0) or columns
+    (axis=1) of x so that the sum of the Euclidean distances between
+    adjacent leaves is minimized.
+
+    The reordered linkage is cached, so the distances are not recomputed
+    when the same array is clustered again.  This requires
+    scipy.cluster.hierarchy.optimal_leaf_ordering (scipy 1.0 or later).
+    If it is not available, lnk is returned unchanged.
+    """
+    if not hasattr(_hierarchy, 'optimal_leaf_ordering'):
+        return lnk
+    cache_key = (axis, 'optimal') + key
+    ordered = _cached_linkage(cache_key)
+    if ordered is None:
+        obs = x if axis == 0 else x.T
+        ordered = _hierarchy.optimal_leaf_ordering(lnk, _pdist(obs, backend))
+        _cache_linkage(cache_key, ordered)
+    return ordered
+
+
+def _compute_linkages(x, top_dendrogram, row_linkage, col_linkage,
+                      leaf_ordering, backend):
+    """
+    Compute the row and column linkages of x.
+
+    The arguments have the same meaning as in heatmapcluster().  Returns
+    (lnk0, lnk1), the row and column linkages; lnk1 is None if
+    top_dendrogram is False.
+    """
+    if leaf_ordering not in [None, 'optimal']:
+        raise ValueError("leaf_ordering must be None or 'optimal'.")
+    backend = _resolve_backend(backend, x)
+
+    if row_linkage is None or (top_dendrogram and col_linkage is None):
+        key = _array_key(x)
+
+    if row_linkage is None and top_dendrogram and col_linkage is None:
+        lnk0, lnk1 = _default_linkages(x, key, backend)
+    else:
+        if row_linkage is None:
+            lnk0 = _default_linkage(x, 0, key, backend)
+        elif isinstance(row_linkage, _np.ndarray):
+            lnk0 = row_linkage
+        else:
+            lnk0 = row_linkage(x)
+        if top_dendrogram:
+            if col_linkage is None:
+                lnk1 = _default_linkage(x, 1, key, backend)
+            elif isinstance(col_linkage, _np.ndarray):
+                lnk1 = col_linkage
+            else:
+                lnk1 = col_linkage(x)
+        else:
+            lnk1 = None
+
+    # Only the default linkages are reordered; a custom linkage may have
+    # been built from a different metric than the Euclidean distance.
+    if leaf_ordering == 'optimal':
+        if row_linkage is None:
+            lnk0 = _optimal_leaf_order(lnk0, x, 0, key, backend)
+        if top_dendrogram and col_linkage is None:
+            lnk1 = _optimal_leaf_order(lnk1, x, 1, key, backend)
+
+    return lnk0, lnk1
 
 
 class HeatmapClusterResults(object):
     """
-    Instances of this class are returned by the function heatmapcluster().
+    Instances of this class are returned by the functions heatmapcluster()
+    and compute().
     """
 
     def __init__(self, **kwds):
@@ -48,6 +466,48 @@ class HeatmapClusterResults(object):
             setattr(self, name, value)
 
 
+def compute(x, top_dendrogram=True, row_linkage=None, col_linkage=None,
+            leaf_ordering=None, backend='auto'):
+    """
+    Compute the row and column linkages of x without creating a plot.
+
+    This does the same clustering as heatmapcluster(), but matplotlib is
+    not used (or imported).
+
+    Parameters
+    ----------
+    x : 2D numpy array with shape (m, n)
+        The array holds m "observations", where each observation is of n
+        variables or features.
+    top_dendrogram : bool
+        If True (the default), the column linkage is computed.
+    row_linkage, col_linkage, leaf_ordering, backend :
+        See heatmapcluster().
+
+    Return value
+    ------------
+    results : Instance of HeatmapClusterResults
+        An object with the attributes `row_linkage`, `col_linkage`,
+        `row_leaves` and `col_leaves`.  The leaves are the orders of the
+        rows and columns given by `scipy.cluster.hierarchy.leaves_list`.
+        If `top_dendrogram` is False, `col_linkage` and `col_leaves` are
+        None.
+    """
+    lnk0, lnk1 = _compute_linkages(x, top_dendrogram, row_linkage,
+                                   col_linkage, leaf_ordering, backend)
+    if top_dendrogram:
+        col_leaves = _hierarchy.leaves_list(lnk1)
+    else:
+        col_leaves = None
+    results = HeatmapClusterResults(
+        row_linkage=lnk0,
+        col_linkage=lnk1,
+        row_leaves=_hierarchy.leaves_list(lnk0),
+        col_leaves=col_leaves,
+    )
+    return results
+
+
 def heatmapcluster(x, row_labels, col_labels,
                    num_row_clusters=None, num_col_clusters=None,
                    label_fontsize=8, cmap=None, show_colorbar=True,
@@ -58,7 +518,10 @@ def heatmapcluster(x, row_labels, col_labels,
                    figsize=(12, 8),
                    row_linkage=None,
                    col_linkage=None,
-                   histogram=None):
+                   histogram=None,
+                   leaf_ordering=None,
+                   backend='auto',
+                   draw_dendrograms=True):
     """
     Use matplotlib to generate a heatmap with row and column dendrograms.
 
@@ -98,21 +561,59 @@ def heatmapcluster(x, row_labels, col_labels,
         the heatmap.
     figsize : tuple of int
         Matplotlib figure size.
-    row_linkage : callable, optional
+    row_linkage : callable or numpy array, optional
         The linkage function for the row dendrogram (i.e. the dendrogram that
         is on the left).  The function must be a callable that accepts a single
-        argument, `x`.  By default,
-            `scipy.cluster.hierarchy(scipy.spatial.distance.pdist(x))`
-        is used.
-    col_linkage : callable, optional
+        argument, `x`.  Alternatively, a precomputed linkage matrix with
+        shape (m - 1, 4) may be given.  By default, the single linkage of
+        the Euclidean distances between the rows of `x` is used, i.e. the
+        same clustering as
+            `scipy.cluster.hierarchy.linkage(scipy.spatial.distance.pdist(x))`
+        Depending on which optional packages are installed (numba, cupy,
+        fastcluster; see also `backend`), it is computed by one of several
+        implementations, some of which round the (centered) data to single
+        precision, so the merge heights can differ slightly from scipy's.
+        The default linkage is cached, so repeated calls with the same `x`
+        do not recompute it; use `clear_cache()` to discard the cached
+        values.
+    col_linkage : callable or numpy array, optional
         The linkage function for the column dendrogram (i.e. the dendrogram
         that is on the top).  The function must be a callable that accepts a
-        single argument, `x`.  By default,
-            `scipy.cluster.hierarchy(scipy.spatial.distance.pdist(x.T))`
-        is used.  This parameter is ignored if `top_dendrogram` is False.
+        single argument, `x`.  Alternatively, a precomputed linkage matrix
+        with shape (n - 1, 4) may be given.  By default, the single linkage
+        of the Euclidean distances between the columns of `x` is used,
+        computed as described for `row_linkage`.  This parameter is ignored
+        if `top_dendrogram` is False.
     histogram : bool, optional
         If `histogram` is True, a histogram of the values in `x` is drawn
         in the colorbar.
+    leaf_ordering : None or str, optional
+        If `leaf_ordering` is 'optimal', the default linkages are reordered
+        with `scipy.cluster.hierarchy.optimal_leaf_ordering` so that the sum
+        of the Euclidean distances between adjacent rows (and columns) of
+        the heatmap is minimized.  A linkage given in `row_linkage` or
+        `col_linkage` is used as given; to reorder it, call
+        `optimal_leaf_ordering` with the distances from which the linkage
+        was computed.  This requires scipy 1.0 or later; with older
+        versions of scipy, the option is ignored.  The reordered linkages
+        are returned in the `row_linkage` and `col_linkage` attributes of
+        the result.  If `leaf_ordering` is None (the default), the leaves
+        are in the order given by `scipy.cluster.hierarchy.dendrogram`.
+    backend : str, optional
+        Where the default Euclidean distances are computed.  If 'cuda',
+        the distances are computed on the GPU with cupy (which must be
+        installed).  If 'cpu', they are computed on the CPU.  If 'auto' (the
+        default), the GPU is used when cupy is installed and `x.size` is
+        greater than the module attribute `cuda_threshold`.  The linkage
+        itself is always computed on the CPU.
+    draw_dendrograms : bool, optional
+        If True (the default), the dendrograms are drawn next to the
+        heatmap.  If False, the dendrograms are not drawn; the rows and
+        columns of the heatmap are still ordered by the linkages (using
+        `scipy.cluster.hierarchy.leaves_list`).  This is faster, and is
+        useful when only the reordered heatmap is wanted.  In this case,
+        the dendrogram and dendrogram axis attributes of the result are
+        None.
 
     Return value
     ------------
@@ -122,30 +623,32 @@ def heatmapcluster(x, row_labels, col_labels,
         plot.
 
     """
-    if row_linkage is None:
-        lnk0 = _hierarchy.linkage(_distance.pdist(x))
-    else:
-        lnk0 = row_linkage(x)
-    if top_dendrogram:
-        if col_linkage is None:
-            lnk1 = _hierarchy.linkage(_distance.pdist(x.T))
-        else:
-            lnk1 = col_linkage(x)
-    else:
-        lnk1 = None
+    # matplotlib is imported here instead of at the top of the module, so
+    # that importing heatmapcluster does not pay the cost of importing it.
+    import matplotlib.pyplot as plt
+    from mpl_toolkits import axes_grid1
+
+    lnk0, lnk1 = _compute_linkages(x, top_dendrogram, row_linkage,
+                                   col_linkage, leaf_ordering, backend)
+
+    row_labels_arr = _np.asarray(row_labels, dtype=object)
+    col_labels_arr = _np.asarray(col_labels, dtype=object)
 
     if cmap is None:
-        cmap = _plt.rcParams['image.cmap']
+        cmap = plt.rcParams['image.cmap']
 
-    fig, ax_heatmap = _plt.subplots(figsize=figsize)
+    fig, ax_heatmap = plt.subplots(figsize=figsize)
     ax_heatmap.yaxis.tick_right()
 
     # Create new axes on the left and on the top of the current axes.
     # These will hold the dendrograms.
-    divider = _axes_grid1.make_axes_locatable(ax_heatmap)
-    ax_dendleft = divider.append_axes("left", 1.2, pad=0.0,
-                                      sharey=ax_heatmap)
-    if top_dendrogram:
+    divider = axes_grid1.make_axes_locatable(ax_heatmap)
+    if draw_dendrograms:
+        ax_dendleft = divider.append_axes("left", 1.2, pad=0.0,
+                                          sharey=ax_heatmap)
+    else:
+        ax_dendleft = None
+    if top_dendrogram and draw_dendrograms:
         ax_dendtop = divider.append_axes("top", 1.2, pad=0.0,
                                          sharex=ax_heatmap)
     else:
@@ -161,26 +664,30 @@ def heatmapcluster(x, row_labels, col_labels,
     else:
         ax_colorbar = None
 
-    ax_dendleft.set_frame_on(False)
-    if top_dendrogram:
+    if ax_dendleft is not None:
+        ax_dendleft.set_frame_on(False)
+    if ax_dendtop is not None:
         ax_dendtop.set_frame_on(False)
 
-    if num_row_clusters is None or num_row_clusters <= 1:
-        left_threshold = -1
+    if not draw_dendrograms:
+        dg0 = None
+        row_leaves = _hierarchy.leaves_list(lnk0)
     else:
-        left_threshold = 0.5*(lnk0[1-num_row_clusters, 2] +
-                              lnk0[-num_row_clusters, 2])
-    if _scipy_version < (0, 17):
-        # Work around bug in older scipy, where the orientation was backwards.
-        side_orientation = 'right'
-    else:
-        side_orientation = 'left'
-    dg0 = _hierarchy.dendrogram(lnk0, ax=ax_dendleft,
-                                orientation=side_orientation,
-                                color_threshold=left_threshold,
-                                no_labels=True)
+        if num_row_clusters is None or num_row_clusters <= 1:
+            left_threshold = -1
+        else:
+            left_threshold = 0.5*(lnk0[1-num_row_clusters, 2] +
+                                  lnk0[-num_row_clusters, 2])
+        dg0 = _hierarchy.dendrogram(lnk0, ax=ax_dendleft,
+                                    orientation='left',
+                                    color_threshold=left_threshold,
+                                    no_labels=True)
+        row_leaves = _np.asarray(dg0['leaves'], dtype=_np.intp)
 
-    if top_dendrogram:
+    if top_dendrogram and not draw_dendrograms:
+        dg1 = None
+        col_leaves = _hierarchy.leaves_list(lnk1)
+    elif top_dendrogram:
         if num_col_clusters is None or num_col_clusters <= 1:
             top_threshold = -1
         else:
@@ -189,66 +696,65 @@ def heatmapcluster(x, row_labels, col_labels,
         dg1 = _hierarchy.dendrogram(lnk1, ax=ax_dendtop,
                                     color_threshold=top_threshold,
                                     no_labels=True)
+        col_leaves = _np.asarray(dg1['leaves'], dtype=_np.intp)
     else:
         dg1 = None
+        col_leaves = None
 
     # Reorder the values in x to match the order of the leaves of
     # the dendrograms.
-    z = x[dg0['leaves'], :]
+    # With both dendrograms, this is done with a single indexing operation.
+    # The extent of the image matches the coordinates used by
+    # scipy.cluster.hierarchy.dendrogram, where the leaves are 10 units
+    # apart.
     if top_dendrogram:
-        z = z[:, dg1['leaves']]
-        ymax = ax_dendtop.get_xlim()[1]
+        z = x[_np.ix_(row_leaves, col_leaves)]
+        ymax = 10*len(col_leaves)
     else:
+        z = x[row_leaves]
         ymax = 1
-    im = ax_heatmap.imshow(z[::-1], aspect='auto', cmap=cmap,
-                           interpolation='nearest',
-                           extent=(0, ymax, 0, ax_dendleft.get_ylim()[1]))
-
+    # With origin='lower', the first row of z is drawn at the bottom, next
+    # to the first leaf of the left dendrogram.
+    im = ax_heatmap.imshow(z, aspect='auto', cmap=cmap,
+                           interpolation='nearest', resample=False,
+                           origin='lower',
+                           extent=(0, ymax, 0, 10*len(row_leaves)))
+    if hasattr(im, 'set_interpolation_stage'):
+        # matplotlib >= 3.5: map the data to colors before resampling.
+        im.set_interpolation_stage('rgba')
+
+    # The ticks are at the centers of the cells of the heatmap.
     xlim = ax_heatmap.get_xlim()[1]
     ncols = len(col_labels)
-    halfxw = 0.5*xlim/ncols
-
-    ax_heatmap.xaxis.set_ticks(_np.linspace(halfxw, xlim - halfxw, ncols))
+    ax_heatmap.xaxis.set_ticks((_np.arange(ncols) + 0.5)*(xlim/ncols))
     if top_dendrogram:
-        ax_heatmap.xaxis.set_ticklabels(_np.array(col_labels)[dg1['leaves']])
+        ax_heatmap.xaxis.set_ticklabels(col_labels_arr[col_leaves])
     else:
-        ax_heatmap.xaxis.set_ticklabels(col_labels)
+        ax_heatmap.xaxis.set_ticklabels(col_labels_arr)
 
     ylim = ax_heatmap.get_ylim()[1]
     nrows = len(row_labels)
-    halfyw = 0.5*ylim/nrows
-
-    ax_heatmap.yaxis.set_ticks(_np.linspace(halfyw, ylim - halfyw, nrows))
-    ax_heatmap.yaxis.set_ticklabels(_np.array(row_labels)[dg0['leaves']])
-
-    # Make the dendrogram labels invisible.
-    _plt.setp(ax_dendleft.get_yticklabels() + ax_dendleft.get_xticklabels(),
-              visible=False)
-    if top_dendrogram:
-        _plt.setp(ax_dendtop.get_xticklabels() + ax_dendtop.get_yticklabels(),
-                  visible=False)
-
-    # Hide all tick lines.
-    lines = (ax_heatmap.xaxis.get_ticklines() +
-             ax_heatmap.yaxis.get_ticklines() +
-             ax_dendleft.xaxis.get_ticklines() +
-             ax_dendleft.yaxis.get_ticklines())
-    _plt.setp(lines, visible=False)
-    if top_dendrogram:
-        lines = (ax_dendtop.xaxis.get_ticklines() +
-                 ax_dendtop.yaxis.get_ticklines())
-        _plt.setp(lines, visible=False)
+    ax_heatmap.yaxis.set_ticks((_np.arange(nrows) + 0.5)*(ylim/nrows))
+    ax_heatmap.yaxis.set_ticklabels(row_labels_arr[row_leaves])
+
+    # Hide all tick lines, and make the dendrogram labels invisible.
+    no_ticks = dict(which='both', left=False, right=False,
+                    bottom=False, top=False)
+    ax_heatmap.tick_params(**no_ticks)
+    if ax_dendleft is not None:
+        ax_dendleft.tick_params(labelleft=False, labelbottom=False,
+                                **no_ticks)
+    if ax_dendtop is not None:
+        ax_dendtop.tick_params(labelleft=False, labelbottom=False, **no_ticks)
 
     xlbls = ax_heatmap.xaxis.get_ticklabels()
-    _plt.setp(xlbls, rotation=xlabel_rotation)
-    _plt.setp(xlbls, fontsize=label_fontsize)
+    plt.setp(xlbls, rotation=xlabel_rotation, fontsize=label_fontsize)
 
     ylbls = ax_heatmap.yaxis.get_ticklabels()
-    _plt.setp(ylbls, rotation=ylabel_rotation)
-    _plt.setp(ylbls, fontsize=label_fontsize)
+    plt.setp(ylbls, rotation=ylabel_rotation, fontsize=label_fontsize)
 
     if show_colorbar:
-        cb = _plt.colorbar(im, cax=ax_colorbar)
+        cb = plt.colorbar(im, cax=ax_colorbar)
         if histogram:
             # This code to draw the histogram in the colorbar can
             # probably be simplified.
@@ -264,7 +770,11 @@ def heatmapcluster(x, row_labels, col_labels,
             # as needed to draw the histogram curve similar to the 'steps-mid'
             # drawstyle of the plot function.
             cc = _np.repeat(counts, 2)
-            ee = _np.r_[edges[0], _np.repeat(edges[1:-1], 2), edges[-1]]
+            ee = _np.empty_like(cc)
+            ee[0] = edges[0]
+            ee[1:-1:2] = edges[1:-1]
+            ee[2:-1:2] = edges[1:-1]
+            ee[-1] = edges[-1]
 
             cb_xmin, cb_xmax = ax_colorbar.get_xbound()
             cb_ymin, cb_ymax = ax_colorbar.get_ybound()
@@ -283,6 +793,8 @@ def heatmapcluster(x, row_labels, col_labels,
         row_dendrogram=dg0,
         col_linkage=lnk1,
         col_dendrogram=dg1,
+        row_leaves=row_leaves,
+        col_leaves=col_leaves,
         fig=fig,
         heatmap_image=im,
         heatmap_axis=ax_heatmap,
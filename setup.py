@@ -47,7 +47,7 @@ setup(name='heatmapcluster',
       py_modules=['heatmapcluster'],
       install_requires=[
           'numpy >= 1.6.0',
-          'scipy',
+          'scipy >= 0.17',
           'matplotlib',
       ],
       keywords="heatmap cluster scipy plot")